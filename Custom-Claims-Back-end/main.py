@@ -1,14 +1,26 @@
 from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict
 from typing import Dict, Any, Optional
-import json
+from cachetools import Cache, TTLCache
+import orjson
+import msgpack
+import asyncio
 import time
 import os
+import sys
+import atexit
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
 import jwt
 import redis
-from datetime import datetime, timedelta
+import redis.asyncio as aioredis
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -17,16 +29,8 @@ load_dotenv()
 app = FastAPI(
     title="Custom Claims Provider", 
     version="1.0.0",
-    description="Microsoft Entra Custom Claims Provider for injecting frontend data into tokens"
-)
-
-# CORS Configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, specify exact domains
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    description="Microsoft Entra Custom Claims Provider for injecting frontend data into tokens",
+    default_response_class=ORJSONResponse
 )
 
 # Configuration
@@ -35,78 +39,253 @@ AZURE_TENANT_ID = os.getenv("AZURE_TENANT_ID", "your-tenant-id")
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 REDIS_DB = int(os.getenv("REDIS_DB", "0"))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
+VALIDATE_TOKENS = os.getenv(
+    "VALIDATE_TOKENS", "true" if ENVIRONMENT == "production" else "false"
+).lower() == "true"
+# Accepted token issuers (comma-separated), v2 and v1 endpoints by default
+AZURE_TOKEN_ISSUERS = [
+    issuer.strip() for issuer in os.getenv(
+        "AZURE_TOKEN_ISSUER",
+        f"https://login.microsoftonline.com/{AZURE_TENANT_ID}/v2.0,"
+        f"https://sts.windows.net/{AZURE_TENANT_ID}/"
+    ).split(",")
+    if issuer.strip()
+]
+# App id of Entra's authentication events service, the only accepted caller
+AZURE_EVENTS_APP_ID = os.getenv("AZURE_EVENTS_APP_ID", "99045fe1-7639-4a75-9d4a-577b6ca3810f")
+FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
+CORS_ORIGINS = [
+    origin.strip() for origin in os.getenv("CORS_ORIGINS", FRONTEND_URL).split(",")
+    if origin.strip()
+]
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# CORS Configuration (explicit origins, methods and headers)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=CORS_ORIGINS,
+    allow_credentials=True,
+    allow_methods=["GET", "POST"],
+    allow_headers=["Authorization", "Content-Type"],
+)
+
+# Logging: handlers enqueue records and a single background thread writes
+# them, so request handlers never block on stdout and lines stay in order
+APP_LOGGER_NAME = "custom_claims"
+ACCESS_LOGGER_NAME = "custom_claims.access"
+
+def configure_logging():
+    """Route the app and access loggers through one queue and one QueueListener"""
+    app_log = logging.getLogger(APP_LOGGER_NAME)
+    access_log = logging.getLogger(ACCESS_LOGGER_NAME)
+    if app_log.handlers:
+        # Already configured (the module can be imported twice, as __main__ and main)
+        return app_log, access_log
+
+    # One writer, one formatter per logger, selected by logger name
+    app_handler = logging.StreamHandler()
+    app_handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+    app_handler.addFilter(lambda record: record.name != ACCESS_LOGGER_NAME)
+    access_handler = logging.StreamHandler()
+    access_handler.setFormatter(
+        logging.Formatter("[REQUEST] %(method)s %(path)s - %(status)s - %(ms).1fms")
+    )
+    access_handler.addFilter(lambda record: record.name == ACCESS_LOGGER_NAME)
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, app_handler, access_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    queue_handler = QueueHandler(log_queue)
+    for queued in (app_log, access_log):
+        queued.setLevel(LOG_LEVEL)
+        queued.addHandler(queue_handler)
+        queued.propagate = False
+    return app_log, access_log
+
+logger, access_logger = configure_logging()
+
+# Wall-clock timestamp shared by responses, refreshed in the background
+# instead of being formatted on every request
+def format_now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+
+_NOW_ISO = format_now_iso()
+_clock_task: Optional[asyncio.Task] = None
+
+async def refresh_now_iso():
+    """Refresh the cached UTC timestamp every 500 ms"""
+    global _NOW_ISO
+    while True:
+        _NOW_ISO = format_now_iso()
+        await asyncio.sleep(0.5)
+
+@app.on_event("startup")
+async def start_clock():
+    global _clock_task
+    _clock_task = asyncio.create_task(refresh_now_iso())
 
-# Redis connection
-try:
-    redis_client = redis.Redis(
-        host=REDIS_HOST, 
-        port=REDIS_PORT, 
-        db=REDIS_DB, 
-        decode_responses=True,
-        socket_connect_timeout=5,
-        socket_timeout=5
+@app.on_event("shutdown")
+async def stop_clock():
+    if _clock_task:
+        _clock_task.cancel()
+
+# Redis connection pool (connection is verified on startup). Values are
+# msgpack-encoded, so responses stay bytes and are decoded explicitly
+redis_pool = aioredis.BlockingConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    decode_responses=False,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=5,
+    socket_connect_timeout=5,
+    socket_timeout=5
+)
+redis_client = aioredis.Redis(connection_pool=redis_pool)
+# Storage backend in use, fixed once the startup connection check has run
+STORAGE_TYPE = "redis"
+
+async def warm_redis_pool():
+    """Open and PING every pooled connection so requests never pay connection setup"""
+    async def ping(connection):
+        await connection.send_command("PING")
+        await connection.read_response()
+
+    results = await asyncio.gather(
+        *[redis_pool.get_connection("PING") for _ in range(REDIS_MAX_CONNECTIONS)],
+        return_exceptions=True
     )
-    # Test connection
-    redis_client.ping()
-    print(f"Connected to Redis at {REDIS_HOST}:{REDIS_PORT}")
-except (redis.ConnectionError, redis.TimeoutError) as e:
-    print(f"Redis connection failed: {e}")
-    print("Falling back to in-memory storage")
-    redis_client = None
+    connections = [c for c in results if not isinstance(c, BaseException)]
+    try:
+        await asyncio.gather(*[ping(c) for c in connections])
+    finally:
+        for connection in connections:
+            await redis_pool.release(connection)
+    return len(connections)
+
+@app.on_event("startup")
+async def connect_redis():
+    """Test the Redis connection, falling back to in-memory storage"""
+    global redis_client, STORAGE_TYPE
+    try:
+        await redis_client.ping()
+        logger.info("Connected to Redis at %s:%s", REDIS_HOST, REDIS_PORT)
+    except (redis.ConnectionError, redis.TimeoutError) as e:
+        logger.warning("Redis connection failed: %s", e)
+        logger.warning("Falling back to in-memory storage")
+        await redis_pool.disconnect()
+        redis_client = None
+        STORAGE_TYPE = "memory"
+        if WEB_CONCURRENCY > 1:
+            logger.warning(
+                "In-memory storage is per process: with %d workers, frontend data stored "
+                "by one worker is not visible to the others and claims will fall back to "
+                "defaults. Run Redis or a single worker.", WEB_CONCURRENCY
+            )
+        return
+
+    try:
+        warmed = await warm_redis_pool()
+        logger.info("Pre-warmed %d Redis connections", warmed)
+    except (redis.ConnectionError, redis.TimeoutError) as e:
+        logger.warning("Redis pool warm-up failed: %s", e)
+
+@app.on_event("shutdown")
+async def disconnect_redis():
+    """Release pooled Redis connections"""
+    await redis_pool.disconnect()
+
+# Fallback storage if Redis is not available (bounded, entries expire after 5 minutes)
+frontend_data_store = TTLCache(maxsize=10_000, ttl=300)
 
-# Fallback storage if Redis is not available
-frontend_data_store = {}
+def expire_memory_data() -> int:
+    """Drop expired in-memory entries and return how many were removed"""
+    # TTLCache.__len__ already skips expired entries, so count the raw store
+    stored_items = Cache.__len__(frontend_data_store)
+    frontend_data_store.expire()
+    return stored_items - Cache.__len__(frontend_data_store)
+
+# Redis keys holding frontend data, so scans can skip unrelated keys
+REDIS_KEY_PREFIX = "fedata:"
+REDIS_SCAN_BATCH = 500
 
 # Helper functions for storage
-def store_data(key: str, data: dict, expiration: int = 300):
+async def store_data(key: str, data: dict, expiration: int = 300):
     """Store data with expiration (default 5 minutes)"""
     try:
         if redis_client:
-            redis_client.setex(key, expiration, json.dumps(data))
+            await redis_client.setex(REDIS_KEY_PREFIX + key, expiration, msgpack.packb(data, use_bin_type=True))
         else:
-            # Fallback to memory with timestamp for manual expiration
-            data['_timestamp'] = time.time()
             frontend_data_store[key] = data
         return True
     except Exception as e:
-        print(f"Error storing data: {e}")
+        logger.error("Error storing data: %s", e)
         return False
 
-def get_data(key: str) -> Optional[dict]:
+async def get_data(key: str) -> Optional[dict]:
     """Get data from storage"""
     try:
         if redis_client:
-            data = redis_client.get(key)
-            return json.loads(data) if data else None
+            data = await redis_client.get(REDIS_KEY_PREFIX + key)
+            return msgpack.unpackb(data, raw=False) if data else None
+        else:
+            return frontend_data_store.get(key)
+    except Exception as e:
+        logger.error("Error getting data: %s", e)
+        return None
+
+async def getdel_data(key: str) -> Optional[dict]:
+    """Get data from storage and delete it in a single round trip"""
+    try:
+        if redis_client:
+            try:
+                data = await redis_client.getdel(REDIS_KEY_PREFIX + key)
+            except redis.ResponseError:
+                # GETDEL needs Redis 6.2+, pipeline GET + DEL otherwise
+                redis_key = REDIS_KEY_PREFIX + key
+                async with redis_client.pipeline(transaction=True) as pipe:
+                    data, _ = await pipe.get(redis_key).delete(redis_key).execute()
+            return msgpack.unpackb(data, raw=False) if data else None
         else:
-            # Fallback with manual cleanup of expired data
-            data = frontend_data_store.get(key)
-            if data and time.time() - data.get('_timestamp', 0) > 300:
-                del frontend_data_store[key]
-                return None
-            return data
+            return frontend_data_store.pop(key, None)
     except Exception as e:
-        print(f"Error getting data: {e}")
+        logger.error("Error getting data: %s", e)
         return None
 
-def delete_data(key: str):
+async def delete_data(key: str):
     """Delete data from storage"""
     try:
         if redis_client:
-            redis_client.delete(key)
+            await redis_client.delete(REDIS_KEY_PREFIX + key)
         else:
             frontend_data_store.pop(key, None)
         return True
     except Exception as e:
-        print(f"Error deleting data: {e}")
+        logger.error("Error deleting data: %s", e)
         return False
 
-def get_storage_stats() -> dict:
+# Redis INFO is large, reuse it for a couple of seconds across health/debug calls
+REDIS_INFO_TTL = 2.0
+_info_cache = {"ts": 0.0, "val": None}
+
+async def cached_info() -> dict:
+    """Get Redis INFO, cached for REDIS_INFO_TTL seconds"""
+    now = time.monotonic()
+    if _info_cache["val"] is None or now - _info_cache["ts"] > REDIS_INFO_TTL:
+        _info_cache["val"] = await redis_client.info()
+        _info_cache["ts"] = now
+    return _info_cache["val"]
+
+async def get_storage_stats() -> dict:
     """Get storage statistics"""
     try:
         if redis_client:
-            info = redis_client.info()
+            info = await cached_info()
             return {
                 "type": "redis",
                 "connected": True,
@@ -116,19 +295,12 @@ def get_storage_stats() -> dict:
             }
         else:
             # Clean expired data before counting
-            current_time = time.time()
-            expired_keys = [
-                key for key, data in frontend_data_store.items()
-                if current_time - data.get('_timestamp', 0) > 300
-            ]
-            for key in expired_keys:
-                del frontend_data_store[key]
-                
+            cleaned_expired = expire_memory_data()
             return {
                 "type": "memory",
                 "connected": True,
                 "stored_items": len(frontend_data_store),
-                "cleaned_expired": len(expired_keys)
+                "cleaned_expired": cleaned_expired
             }
     except Exception as e:
         return {
@@ -139,6 +311,86 @@ def get_storage_stats() -> dict:
 
 security = HTTPBearer()
 
+# Entra signing keys, fetched once and cached by kid. Unknown kids are
+# rejected against the cache; after a successful fetch the JWKS is refetched
+# at most once per JWKS_MIN_REFRESH_INTERVAL, so made-up kids cannot force a
+# fetch per request. A failed fetch is retried after JWKS_RETRY_INTERVAL
+JWKS_TIMEOUT = 3
+JWKS_MIN_REFRESH_INTERVAL = 300
+JWKS_RETRY_INTERVAL = 5
+jwks_client = jwt.PyJWKClient(
+    f"https://login.microsoftonline.com/{AZURE_TENANT_ID}/discovery/v2.0/keys",
+    lifespan=3600,
+    timeout=JWKS_TIMEOUT
+)
+_signing_keys: Dict[str, Any] = {}
+_signing_keys_next_refresh = float("-inf")
+_signing_keys_lock = threading.Lock()
+
+def refresh_signing_keys():
+    """Reload the Entra signing keys from the JWKS endpoint"""
+    global _signing_keys, _signing_keys_next_refresh
+    # Short backoff first, so a failed fetch (which raises) is retried soon
+    _signing_keys_next_refresh = time.monotonic() + JWKS_RETRY_INTERVAL
+    _signing_keys = {key.key_id: key.key for key in jwks_client.get_signing_keys(refresh=True)}
+    _signing_keys_next_refresh = time.monotonic() + JWKS_MIN_REFRESH_INTERVAL
+
+def get_signing_key(kid: Optional[str]):
+    """Look up a signing key by kid, refreshing the cached set only if it is due"""
+    key = _signing_keys.get(kid)
+    if key is None:
+        with _signing_keys_lock:
+            key = _signing_keys.get(kid)
+            due = time.monotonic() >= _signing_keys_next_refresh
+            if key is None and due:
+                refresh_signing_keys()
+                key = _signing_keys.get(kid)
+    if key is None:
+        raise jwt.InvalidTokenError(f"Unknown signing key id: {kid}")
+    return key
+
+@app.on_event("startup")
+async def load_signing_keys():
+    """Fetch the Entra JWKS up front so the first token validation does not wait on it"""
+    if not VALIDATE_TOKENS:
+        return
+    try:
+        await run_in_threadpool(refresh_signing_keys)
+        logger.info("Loaded Entra signing keys for tenant %s", AZURE_TENANT_ID)
+    except jwt.PyJWKClientError as e:
+        logger.warning("Could not load Entra signing keys: %s", e)
+
+def verify_entra_token(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Optional[dict]:
+    """
+    Validate the bearer token sent by Entra and return its claims.
+    Sync on purpose: FastAPI runs it in the threadpool, keeping JWKS
+    refreshes and RSA verification off the event loop.
+    """
+    if not VALIDATE_TOKENS:
+        return None
+    token = credentials.credentials
+    try:
+        signing_key = get_signing_key(jwt.get_unverified_header(token).get("kid"))
+        claims = jwt.decode(
+            token,
+            signing_key,
+            algorithms=["RS256"],
+            audience=AZURE_CLIENT_ID,
+            options={"require": ["exp", "aud", "iss"]}
+        )
+        # PyJWT 2.8 only matches a single issuer, so check the accepted list here
+        if claims["iss"] not in AZURE_TOKEN_ISSUERS:
+            raise jwt.InvalidIssuerError("Invalid issuer")
+        # azp in v2 tokens, appid in v1 tokens
+        if claims.get("azp", claims.get("appid")) != AZURE_EVENTS_APP_ID:
+            raise jwt.InvalidTokenError("Token was not issued to the authentication events service")
+        return claims
+    except jwt.PyJWTError as e:
+        logger.warning("Rejected Entra token: %s", e)
+        raise HTTPException(status_code=401, detail="Invalid token")
+
 # Data models
 class FrontendData(BaseModel):
     user_id: str
@@ -147,8 +399,15 @@ class FrontendData(BaseModel):
     custom_data: Optional[str] = None
     timestamp: float
 
+class EntraUser(BaseModel):
+    # Only the fields used to look up frontend data; the rest of the user blob is skipped
+    model_config = ConfigDict(extra="ignore")
+
+    userPrincipalName: Optional[str] = None
+    id: Optional[str] = None
+
 class AuthenticationContext(BaseModel):
-    user: Dict[str, Any]
+    user: EntraUser
     correlationId: str
     client: Dict[str, Any]
     protocol: str
@@ -166,7 +425,7 @@ class ClaimsResponse(BaseModel):
     data: Dict[str, Any]
 
 # Endpoint for frontend to store data temporarily
-@app.post("/api/store-frontend-data")
+@app.post("/api/store-frontend-data", response_model=None, response_class=ORJSONResponse)
 async def store_frontend_data(frontend_data: FrontendData):
     """
     Endpoint for frontend to store data before authentication
@@ -181,102 +440,123 @@ async def store_frontend_data(frontend_data: FrontendData):
         }
         
         # Store data with expiration (5 minutes)
-        success = store_data(frontend_data.user_id, data_to_store, 300)
+        success = await store_data(frontend_data.user_id, data_to_store, 300)
         
         if success:
-            return {
+            # Returned as a response object so FastAPI skips jsonable_encoder
+            return ORJSONResponse(content={
                 "success": True,
                 "message": "Data stored successfully",
                 "user_id": frontend_data.user_id,
                 "expires_in": 300,
-                "storage_type": "redis" if redis_client else "memory"
-            }
+                "storage_type": STORAGE_TYPE
+            })
         else:
             raise HTTPException(status_code=500, detail="Failed to store data")
             
     except Exception as e:
-        print(f"Error in store_frontend_data: {str(e)}")
+        logger.error("Error in store_frontend_data: %s", e)
         raise HTTPException(status_code=500, detail=f"Error storing data: {str(e)}")
 
+# Fixed parts of the claims response, built once
+_KEY_BU = sys.intern("businessUnit")
+_KEY_DI = sys.intern("deviceInfo")
+_KEY_CD = sys.intern("customData")
+_KEY_DS = sys.intern("dataSource")
+_KEY_DA = sys.intern("dataAge")
+_ODATA_TYPE = sys.intern("microsoft.graph.tokenIssuanceStart.provideClaimsForToken")
+
+_STATIC_CLAIMS = {"apiVersion": "1.0.0", "source": "custom-claims-provider"}
+_DEFAULT_FRONTEND_CLAIMS = {
+    _KEY_BU: "Default",
+    _KEY_DI: "Server-Generated",
+    _KEY_CD: "No frontend data available",
+    _KEY_DS: "default"
+}
+
 # Main endpoint that Entra will call
-@app.post("/api/custom-claims")
+@app.post("/api/custom-claims", response_model=None, response_class=ORJSONResponse)
 async def custom_claims_provider(
     event: TokenIssuanceEvent,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    token_claims: Optional[dict] = Depends(verify_entra_token)
 ):
     """
     Custom Claims Provider endpoint for Microsoft Entra
     """
     try:
-        # Validate the Entra token (optional but recommended)
-        # In production you should validate the JWT token here
-        
         # Extract user information
         user_context = event.data.authenticationContext.user
-        user_id = user_context.get("userPrincipalName") or user_context.get("id")
+        user_id = user_context.userPrincipalName or user_context.id
         
-        print(f"[INFO] Processing claims for user: {user_id}")
-        print(f"[DEBUG] Full event data: {json.dumps(event.dict(), indent=2)}")
+        logger.info("Processing claims for user: %s", user_id)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Full event data: %s", event.model_dump_json(indent=2))
         
-        # Look for stored frontend data
-        stored_data = get_data(user_id)
+        # Look for stored frontend data (removed from storage as it is read)
+        stored_data = await getdel_data(user_id)
         
         # Create custom claims
         custom_claims = {
-            "apiVersion": "1.0.0",
+            **_STATIC_CLAIMS,
             "correlationId": event.data.authenticationContext.correlationId,
-            "timestamp": datetime.utcnow().isoformat(),
-            "source": "custom-claims-provider",
-            "storage_type": "redis" if redis_client else "memory"
+            "timestamp": _NOW_ISO,
+            "storage_type": STORAGE_TYPE
         }
         
         # Add frontend data if available
         if stored_data:
+            now = time.time()
             custom_claims.update({
-                "businessUnit": stored_data.get("business_unit", "Unknown"),
-                "deviceInfo": stored_data.get("device_info", "Unknown"),
-                "customData": stored_data.get("custom_data", ""),
-                "dataSource": "frontend",
-                "dataAge": time.time() - stored_data.get("timestamp", time.time())
+                _KEY_BU: stored_data.get("business_unit", "Unknown"),
+                _KEY_DI: stored_data.get("device_info", "Unknown"),
+                _KEY_CD: stored_data.get("custom_data", ""),
+                _KEY_DS: "frontend",
+                _KEY_DA: now - stored_data.get("timestamp", now)
             })
-            
-            # Clean data after using
-            delete_data(user_id)
-            print(f"[INFO] Used and cleaned frontend data for {user_id}")
+            logger.info("Used and cleaned frontend data for %s", user_id)
         else:
             # Default claims if no frontend data
-            custom_claims.update({
-                "businessUnit": "Default",
-                "deviceInfo": "Server-Generated",
-                "customData": "No frontend data available",
-                "dataSource": "default"
-            })
-            print(f"[WARN] No frontend data found for {user_id}")
+            custom_claims.update(_DEFAULT_FRONTEND_CLAIMS)
+            logger.warning("No frontend data found for %s", user_id)
         
         # Response format required by Microsoft Entra
         response = {
             "data": {
-                "actions": [{
-                    "@odata.type": "microsoft.graph.tokenIssuanceStart.provideClaimsForToken",
-                    "claims": custom_claims
-                }]
+                "actions": [{"@odata.type": _ODATA_TYPE, "claims": custom_claims}]
             }
         }
         
-        print(f"[INFO] Returning claims: {json.dumps(custom_claims, indent=2)}")
-        return response
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Returning claims: %s", orjson.dumps(custom_claims, option=orjson.OPT_INDENT_2).decode())
+        return ORJSONResponse(content=response)
         
     except Exception as e:
-        print(f"[ERROR] Error processing claims: {str(e)}")
+        logger.error("Error processing claims: %s", e)
         raise HTTPException(status_code=500, detail=f"Error processing claims: {str(e)}")
 
-# Health check endpoint
-@app.get("/health")
+# Liveness probe: a bare ASGI app writing a prebuilt body, skipping
+# FastAPI's dependency resolution, validation and response encoding
+_HEALTH_BODY = orjson.dumps({"status": "healthy"})
+_HEALTH_HEADERS = [
+    (b"content-type", b"application/json"),
+    (b"content-length", str(len(_HEALTH_BODY)).encode())
+]
+
+class HealthProbe:
+    # A class instance rather than a function, so Starlette mounts it as raw ASGI
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": _HEALTH_HEADERS})
+        await send({"type": "http.response.body", "body": _HEALTH_BODY})
+
+app.add_route("/health", HealthProbe(), methods=["GET"], include_in_schema=False)
+
+# Detailed health check endpoint
+@app.get("/health/deep")
 async def health_check():
-    storage_stats = get_storage_stats()
+    storage_stats = await get_storage_stats()
     return {
         "status": "healthy",
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": _NOW_ISO,
         "environment": ENVIRONMENT,
         "storage": storage_stats,
         "azure_config": {
@@ -286,47 +566,44 @@ async def health_check():
     }
 
 # Debug endpoint to view stored data
-@app.get("/debug/stored-data")
+@app.get("/debug/stored-data", response_model=None, response_class=ORJSONResponse)
 async def debug_stored_data():
     """
     Debug endpoint to see what data is stored
     """
     try:
         if redis_client:
-            # For Redis, get all keys that are not system keys
-            keys = redis_client.keys("*")
+            # For Redis, SCAN the frontend data keys and fetch them in MGET batches
+            keys = [
+                key async for key in redis_client.scan_iter(
+                    match=f"{REDIS_KEY_PREFIX}*", count=REDIS_SCAN_BATCH
+                )
+            ]
             stored_data = {}
-            for key in keys:
-                try:
-                    data = redis_client.get(key)
+            for i in range(0, len(keys), REDIS_SCAN_BATCH):
+                batch = keys[i:i + REDIS_SCAN_BATCH]
+                values = await redis_client.mget(batch)
+                # store_data is the only writer of these keys, so every value is msgpack
+                for key, data in zip(batch, values):
                     if data:
-                        stored_data[key] = json.loads(data)
-                except json.JSONDecodeError:
-                    stored_data[key] = data  # Raw data if not JSON
-            
-            return {
+                        user_id = key[len(REDIS_KEY_PREFIX):].decode()
+                        stored_data[user_id] = msgpack.unpackb(data, raw=False)
+
+            return ORJSONResponse(content={
                 "storage_type": "redis",
                 "stored_data": stored_data,
                 "count": len(stored_data),
-                "redis_info": redis_client.info()
-            }
+                "redis_info": await cached_info()
+            })
         else:
             # For memory, clean expired data first
-            current_time = time.time()
-            expired_keys = [
-                key for key, data in frontend_data_store.items()
-                if current_time - data.get('_timestamp', 0) > 300
-            ]
-            
-            for key in expired_keys:
-                del frontend_data_store[key]
-            
-            return {
+            cleaned_expired = expire_memory_data()
+            return ORJSONResponse(content={
                 "storage_type": "memory",
-                "stored_data": frontend_data_store,
+                "stored_data": dict(frontend_data_store),
                 "count": len(frontend_data_store),
-                "cleaned_expired": len(expired_keys)
-            }
+                "cleaned_expired": cleaned_expired
+            })
     except Exception as e:
         return {
             "error": str(e),
@@ -336,13 +613,29 @@ async def debug_stored_data():
 # Middleware for logging
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = time.time()
+    # Monotonic clock for the duration; wall-clock timestamps are only used as data
+    start_ns = time.perf_counter_ns()
     response = await call_next(request)
-    process_time = time.time() - start_time
-    
-    print(f"[REQUEST] {request.method} {request.url.path} - {response.status_code} - {process_time:.3f}s")
+    elapsed_ms = (time.perf_counter_ns() - start_ns) / 1e6
+
+    access_logger.info("request", extra={
+        "method": request.method,
+        "path": request.scope["path"],
+        "status": response.status_code,
+        "ms": elapsed_ms
+    })
     return response
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, debug=True)
\ No newline at end of file
+    # uvloop event loop + httptools parser, one process per worker (WEB_CONCURRENCY,
+    # default 1; the in-memory fallback store is per process, so more workers need Redis)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=WEB_CONCURRENCY,
+        log_level="info"
+    )